@@ -98,15 +98,14 @@ def _load_yaml(filename):
 
 
 def try_configs(files):
-    for config_file in files:
-        config_file = os.path.expanduser(config_file)
-        config_dir = os.path.abspath(os.path.dirname(config_file))
-        config_base = os.path.basename(config_file)
-        if os.path.isdir(config_dir):
-            with _with_chdir(config_dir):
-                if os.path.exists(config_base):
-                    return _load_yaml(config_base)
-    return None
+    paths = [os.path.abspath(os.path.expanduser(config_file))
+             for config_file in files]
+    config_file = next((path for path in paths
+                        if os.access(path, os.R_OK)), None)
+    if config_file is None:
+        return None
+    with _with_chdir(os.path.dirname(config_file)):
+        return _load_yaml(os.path.basename(config_file))
 
 
 # vim:et:fdm=marker:sts=4:sw=4:ts=4
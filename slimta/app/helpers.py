@@ -19,17 +19,26 @@
 # THE SOFTWARE.
 #
 
+import ast
+import hmac
 import math
+import os
+import re
 import socket
-from functools import wraps
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
 
+import gevent
+from gevent.event import Event
 from pysasl.hashing import get_hash
 from pysasl.identity import HashedIdentity
 from slimta.edge.smtp import SmtpValidators
 from slimta.edge.wsgi import WsgiValidators, WsgiResponse
 from slimta.util.dnsbl import check_dnsbl, DnsBlocklist, DnsBlocklistGroup
 from slimta.util.spf import EnforceSpf
-from slimta.lookup.drivers.dict import DictLookup
+from slimta.lookup.drivers import LookupBase
 from slimta.lookup.drivers.regex import RegexLookup
 from slimta.lookup.policy import LookupPolicy
 
@@ -43,20 +52,213 @@ from .lookup import load_lookup
 from .validation import ConfigValidationError
 
 
+def _connect_unix_socket(address):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class _SizeLimitedSpamAssassin(SpamAssassin):
+
+    def __init__(self, address, max_bytes=None, socket_creator=None):
+        super(_SizeLimitedSpamAssassin, self).__init__(
+            address, socket_creator=socket_creator)
+        self.max_bytes = max_bytes
+
+    def is_oversized(self, size):
+        return self.max_bytes is not None and size > self.max_bytes
+
+    def apply(self, envelope):
+        if self.max_bytes is not None:
+            header_data, message_data = envelope.flatten()
+            if self.is_oversized(len(header_data) + len(message_data)):
+                # Never pass along spam headers the sender supplied.
+                del envelope.headers['X-Spam-Status']
+                del envelope.headers['X-Spam-Symbols']
+                return
+        super(_SizeLimitedSpamAssassin, self).apply(envelope)
+
+
 def _get_spamassassin_object(options):
+    max_bytes = options.get('max_bytes')
+    if max_bytes is not None:
+        max_bytes = int(max_bytes)
+    if 'path' in options:
+        return _SizeLimitedSpamAssassin(options.path, max_bytes,
+                                        socket_creator=_connect_unix_socket)
     host = options.get('host', 'localhost')
     port = int(options.get('port', 783))
-    return SpamAssassin((host, port))
+    return _SizeLimitedSpamAssassin((host, port), max_bytes)
+
+
+@lru_cache(maxsize=16)
+def _get_password_hash(passlib_config):
+    return get_hash(passlib_config=passlib_config)
+
+
+class _ExpiringCache(object):
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            value, expires = self._entries[key]
+        except KeyError:
+            return None
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class _CachedIdentity(HashedIdentity):
+
+    __slots__ = ['_cache']
+
+    _hmac_key = os.urandom(32)
+
+    def __init__(self, authcid, digest, *, hash, cache):
+        super(_CachedIdentity, self).__init__(authcid, digest, hash=hash)
+        self._cache = cache
+
+    def compare_secret(self, secret):
+        mac = hmac.new(self._hmac_key, secret.encode('utf-8'), 'sha256')
+        key = (self.authcid, self.digest, mac.digest())
+        if self._cache.get(key):
+            return True
+        if not super(_CachedIdentity, self).compare_secret(secret):
+            return False
+        self._cache.set(key, True)
+        return True
+
+
+class _CachedDnsBlocklistGroup(DnsBlocklistGroup):
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        super(_CachedDnsBlocklistGroup, self).__init__()
+        self._cache = _ExpiringCache(maxsize, ttl)
+
+    def add_blocklist(self, dnsbl):
+        self.dnsbls.append(dnsbl)
+
+    def _run_cached_get(self, matches, failed, dnsbl, ip):
+        try:
+            # With strict=None, a DNS error other than NXDOMAIN returns None
+            # instead of a verdict.
+            listed = dnsbl.get(ip, strict=None)
+        except ValueError:
+            return
+        if listed:
+            matches.add(dnsbl.address)
+        elif listed is None:
+            failed.append(dnsbl.address)
+
+    def get(self, ip, timeout=None):
+        matches = self._cache.get(ip)
+        if matches is not None:
+            return matches
+        matches = set()
+        failed = []
+        done = Event()
+        remaining = len(self.dnsbls)
+
+        def finished(thread):
+            nonlocal remaining
+            remaining -= 1
+            if matches or not remaining:
+                done.set()
+        threads = [self.pool.spawn(self._run_cached_get, matches, failed,
+                                   dnsbl, ip)
+                   for dnsbl in self.dnsbls]
+        for thread in threads:
+            thread.link(finished)
+        completed = done.wait(timeout)
+        gevent.killall(threads)
+        if completed and (matches or not failed):
+            self._cache.set(ip, matches)
+        return matches
+
+
+class _AddressSetLookup(LookupBase):
+
+    _found = MappingProxyType({})
+
+    def __init__(self, addresses):
+        super(_AddressSetLookup, self).__init__()
+        self.addresses = frozenset(addr.lower() for addr in addresses)
+
+    def lookup(self, **kwargs):
+        address = kwargs.get('address', '')
+        ret = self._found if address.lower() in self.addresses else None
+        self.log(__name__, kwargs, ret)
+        return ret
+
+
+class _CombinedRegexLookup(RegexLookup):
+
+    _backref_pattern = re.compile(r'\\[1-9]|\\g<|\(\?P=|\(\?\(')
+
+    def __init__(self, str_template):
+        super(_CombinedRegexLookup, self).__init__(str_template)
+        self.combined = None
+        self.group_values = {}
+
+    def compile(self):
+        patterns = [regex.pattern for regex, _ in self.regexes]
+        if not patterns:
+            return
+        if any(self._backref_pattern.search(p) for p in patterns):
+            return
+        alternatives = ['({0})'.format(p) for p in patterns]
+        group = 1
+        for regex, value in self.regexes:
+            self.group_values[group] = value
+            group += regex.groups + 1
+        try:
+            self.combined = re.compile('|'.join(alternatives))
+        except re.error:
+            self.combined = None
+
+    def lookup(self, **kwargs):
+        if self.combined is None:
+            return super(_CombinedRegexLookup, self).lookup(**kwargs)
+        ret = None
+        try:
+            lookup_str = self.str_template.format(**kwargs)
+        except KeyError:
+            pass
+        else:
+            match = self.combined.match(lookup_str)
+            if match and match.lastindex is not None:
+                ret = self.group_values[match.lastindex]
+        self.log(RegexLookup.__module__, kwargs, ret)
+        return ret
 
 
 class RuleHelpers(object):
 
+    __slots__ = ('banner', 'dnsbl', 'lookup_senders', 'lookup_rcpts',
+                 'lookup_creds', 'password_hash', 'reject_spf', 'scanner',
+                 '_cred_cache', '_banner_decorator',
+                 '_mail_decorator')
+
     @staticmethod
     def _noop_decorator(f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            return f(*args, **kwargs)
-        return wrapper
+        return f
 
     def __init__(self, options):
         rules = options.get('rules', {})
@@ -68,20 +270,23 @@ class RuleHelpers(object):
                                              'only_recipients',
                                              'regex_recipients')
         self.lookup_creds = load_lookup(rules.lookup_credentials)
-        self.password_hash = get_hash(passlib_config=rules.passlib_config)
+        self.password_hash = _get_password_hash(rules.passlib_config)
+        self._cred_cache = _ExpiringCache(4096, 900.0)
         self.reject_spf = rules.reject_spf
         self.scanner = self._get_scanner(rules.reject_spam)
+        self._banner_decorator = self._build_banner_decorator()
+        self._mail_decorator = self._build_mail_decorator()
 
     def _get_lookup(self, rules, lookup_section, list_section, regex_section):
         if lookup_section in rules:
             return load_lookup(rules[lookup_section])
         elif list_section in rules:
-            map = dict.fromkeys(rules[list_section], {})
-            return DictLookup(map, '{address}')
+            return _AddressSetLookup(rules[list_section])
         elif regex_section in rules:
-            lookup = RegexLookup('{address}')
+            lookup = _CombinedRegexLookup('{address}')
             for item in rules[regex_section]:
                 lookup.add_regex(item, {})
+            lookup.compile()
             return lookup
 
     def _get_scanner(self, options):
@@ -99,8 +304,9 @@ class RuleHelpers(object):
                                                authzid=creds.authzid)
         if not ret or 'password' not in ret:
             return False
-        identity = HashedIdentity(creds.authcid, ret['password'],
-                                  hash=self.password_hash)
+        identity = _CachedIdentity(creds.authcid, ret['password'],
+                                   hash=self.password_hash,
+                                   cache=self._cred_cache)
         if not creds.verify(identity):
             return False
         return True
@@ -117,22 +323,21 @@ class RuleHelpers(object):
             return self.lookup_rcpts.lookup_address(recipient) is not None
         return True
 
-    def get_banner_decorator(self):
+    def _build_banner_decorator(self):
         if self.dnsbl:
+            blgroup = _CachedDnsBlocklistGroup()
             if isinstance(self.dnsbl, list):
-                blgroup = DnsBlocklistGroup()
                 for bl in self.dnsbl:
                     blgroup.add_dnsbl(bl)
-                return check_dnsbl(blgroup, match_code='520')
+            elif isinstance(self.dnsbl, str):
+                blgroup.add_dnsbl(self.dnsbl)
             else:
-                if isinstance(self.dnsbl, str):
-                    bl = self.dnsbl
-                else:
-                    bl = DnsBlocklist(self.dnsbl.address, self.dnsbl.ignore)
-                return check_dnsbl(bl, match_code='520')
+                blgroup.add_blocklist(DnsBlocklist(self.dnsbl.address,
+                                                   self.dnsbl.ignore))
+            return check_dnsbl(blgroup, match_code='520')
         return self._noop_decorator
 
-    def get_mail_decorator(self):
+    def _build_mail_decorator(self):
         if self.reject_spf:
             spf = EnforceSpf()
             msg = '5.7.1 Access denied; {reason}'
@@ -142,12 +347,18 @@ class RuleHelpers(object):
             return spf.check
         return self._noop_decorator
 
+    def get_banner_decorator(self):
+        return self._banner_decorator
+
+    def get_mail_decorator(self):
+        return self._mail_decorator
+
     def set_banner_message(self, reply):
         if self.banner:
             reply.message = self.banner
 
     def reject_spam(self, data):
-        if self.scanner:
+        if self.scanner and not self.scanner.is_oversized(len(data)):
             is_spam, info = self.scanner.scan(data)
             return is_spam
         return False
@@ -157,31 +368,38 @@ def build_smtpedge_validators(options):
     rules = RuleHelpers(options)
 
     class CustomValidators(SmtpValidators):
-        @rules.get_banner_decorator()
-        def handle_banner(self, reply, address):
-            rules.set_banner_message(reply)
-
-        def handle_auth(self, reply, creds):
-            if not rules.check_credentials(creds):
+        if rules.banner or rules.dnsbl:
+            @rules.get_banner_decorator()
+            def handle_banner(self, reply, address,
+                              _set_banner=rules.set_banner_message):
+                _set_banner(reply)
+
+        def handle_auth(self, reply, creds, _check=rules.check_credentials):
+            if not _check(creds):
                 reply.code = '535'
                 reply.message = '5.7.8 Authentication credentials invalid'
 
-        @rules.get_mail_decorator()
-        def handle_mail(self, reply, sender, params):
-            if not rules.is_sender_ok(self, sender):
-                reply.code = '550'
-                reply.message = '5.7.1 Sender <{0}> Not allowed'.format(sender)
-
-        def handle_rcpt(self, reply, rcpt, params):
-            if not rules.is_recipient_ok(rcpt):
-                reply.code = '550'
-                reply.message = '5.7.1 Recipient <{0}> Not allowed'.format(
-                    rcpt)
-
-        def handle_have_data(self, reply, data):
-            if rules.reject_spam(data):
-                reply.code = '554'
-                reply.message = '5.6.0 Message content rejected'
+        if rules.lookup_senders or rules.lookup_creds or rules.reject_spf:
+            @rules.get_mail_decorator()
+            def handle_mail(self, reply, sender, params,
+                            _is_ok=rules.is_sender_ok):
+                if not _is_ok(self, sender):
+                    reply.code = '550'
+                    reply.message = f'5.7.1 Sender <{sender}> Not allowed'
+
+        if rules.lookup_rcpts:
+            def handle_rcpt(self, reply, rcpt, params,
+                            _is_ok=rules.is_recipient_ok):
+                if not _is_ok(rcpt):
+                    reply.code = '550'
+                    reply.message = f'5.7.1 Recipient <{rcpt}> Not allowed'
+
+        if rules.scanner:
+            def handle_have_data(self, reply, data,
+                                 _reject=rules.reject_spam):
+                if _reject(data):
+                    reply.code = '554'
+                    reply.message = '5.6.0 Message content rejected'
     return CustomValidators
 
 
@@ -189,68 +407,135 @@ def build_wsgiedge_validators(options):
     rules = RuleHelpers(options)
 
     class CustomValidators(WsgiValidators):
-        def validate_sender(self, sender):
-            if not rules.is_sender_ok(self, sender):
-                smtp_code = '550'
-                smtp_message = '5.7.1 Sender <{0}> Not allowed'.format(sender)
-                reply = '{0}; message="{1}"'.format(smtp_code, smtp_message)
+        def validate_sender(self, sender, _is_ok=rules.is_sender_ok):
+            if not _is_ok(self, sender):
+                reply = f'550; message="5.7.1 Sender <{sender}> Not allowed"'
                 raise WsgiResponse('403 Forbidden', [('X-Smtp-Reply', reply)])
 
-        def validate_recipient(self, rcpt):
-            if not rules.is_recipient_ok(rcpt):
-                smtp_code = '550'
-                smtp_message = '5.7.1 Recipient <{0}> Not allowed'.format(rcpt)
-                reply = '{0}; message="{1}"'.format(smtp_code, smtp_message)
+        def validate_recipient(self, rcpt, _is_ok=rules.is_recipient_ok):
+            if not _is_ok(rcpt):
+                reply = f'550; message="5.7.1 Recipient <{rcpt}> Not allowed"'
                 raise WsgiResponse('403 Forbidden', [('X-Smtp-Reply', reply)])
     return CustomValidators
 
 
+def _build_messageid_policy(policy):
+    hostname = fill_hostname_template(policy.hostname)
+    return AddMessageIdHeader(hostname or _get_hostname_vars()['fqdn'])
+
+
+def _build_lookup_policy(policy):
+    lookup = load_lookup(policy.get('lookup', {}))
+    on_sender = policy.get('on_sender', False)
+    on_rcpts = policy.get('on_recipients', True)
+    if not lookup:
+        msg = 'Incomplete lookup policy section'
+        raise ConfigValidationError(msg)
+    return LookupPolicy(lookup, on_sender=on_sender, on_rcpts=on_rcpts)
+
+
+def _build_forward_policy(policy):
+    forward = Forward()
+    for pattern, repl in policy.get('mapping', {}).items():
+        forward.add_mapping(pattern, repl)
+    return forward
+
+
+# Important! Must be last, after all modifications of headers and message.
+# Otherwise, signature will be invalid and email will not be delivered.
+# You can test validity of signature by sending email on address, generated
+# here: https://wander.science/projects/email/dkimtest/
+def _build_dkim_policy(policy):
+    return AddDKIMHeader(dkim=policy.get('dkim', {}))
+
+
+_queue_policies = {
+    'add_date_header': lambda policy: AddDateHeader(),
+    'add_messageid_header': _build_messageid_policy,
+    'add_received_header': lambda policy: AddReceivedHeader(),
+    'recipient_split': lambda policy: RecipientSplit(),
+    'recipient_domain_split': lambda policy: RecipientDomainSplit(),
+    'lookup': _build_lookup_policy,
+    'forward': _build_forward_policy,
+    'spamassassin': _get_spamassassin_object,
+    'add_dkim_header': _build_dkim_policy}
+
+
 def add_queue_policies(queue, policy_options):
     for policy in policy_options:
-        if policy.type == 'add_date_header':
-            queue.add_policy(AddDateHeader())
-        elif policy.type == 'add_messageid_header':
-            hostname = policy.hostname
-            queue.add_policy(AddMessageIdHeader(hostname))
-        elif policy.type == 'add_received_header':
-            queue.add_policy(AddReceivedHeader())
-        elif policy.type == 'recipient_split':
-            queue.add_policy(RecipientSplit())
-        elif policy.type == 'recipient_domain_split':
-            queue.add_policy(RecipientDomainSplit())
-        elif policy.type == 'lookup':
-            lookup = load_lookup(policy.get('lookup', {}))
-            on_sender = policy.get('on_sender', False)
-            on_rcpts = policy.get('on_recipients', True)
-            if lookup:
-                lookup_policy = LookupPolicy(lookup, on_sender=on_sender,
-                                             on_rcpts=on_rcpts)
-                queue.add_policy(lookup_policy)
-            else:
-                msg = 'Incomplete lookup policy section'
-                raise ConfigValidationError(msg)
-        elif policy.type == 'forward':
-            forward = Forward()
-            for pattern, repl in list(dict(policy.get('mapping', {})).items()):
-                forward.add_mapping(pattern, repl)
-            queue.add_policy(forward)
-        elif policy.type == 'spamassassin':
-            queue.add_policy(_get_spamassassin_object(policy))
-        # Important! Must be last, after all modifications of headers and message. 
-        # Otherwise, signature will be invalid and email will not be delivered.
-        # You can test validity of signature by sending email on address, generated here: 
-        # https://wander.science/projects/email/dkimtest/
-        elif policy.type == 'add_dkim_header':
-            queue.add_policy(AddDKIMHeader(
-                dkim=policy.get('dkim', {}),
-            ))
+        try:
+            build_policy = _queue_policies[policy.type]
+        except KeyError:
+            msg = 'queue policy type does not exist: '+policy.type
+            raise ConfigValidationError(msg)
+        queue.add_policy(build_policy(policy))
+
+
+class _HostnameVars(dict):
+
+    def __missing__(self, key):
+        return '{'+key+'}'
+
+
+_hostname_vars = None
+
+
+def _get_hostname_vars():
+    global _hostname_vars
+    if _hostname_vars is None:
+        _hostname_vars = _HostnameVars(fqdn=socket.getfqdn(),
+                                       hostname=socket.gethostname())
+    return _hostname_vars
+
+
+def clear_caches():
+    global _hostname_vars
+    _hostname_vars = None
+    _get_password_hash.cache_clear()
 
 
 def fill_hostname_template(val):
     if not val:
         return val
-    return val.format(fqdn=socket.getfqdn(),
-                      hostname=socket.gethostname())
+    return val.format_map(_get_hostname_vars())
+
+
+_delay_names = dict((name, getattr(math, name)) for name in dir(math)
+                    if not name.startswith('_'))
+for _builtin in (abs, float, int, max, min, pow, round):
+    _delay_names.setdefault(_builtin.__name__, _builtin)
+
+_delay_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.operator,
+                ast.unaryop, ast.Constant, ast.Name, ast.Load, ast.Call,
+                ast.IfExp, ast.Compare, ast.cmpop, ast.BoolOp, ast.boolop)
+
+_delay_table_size = 100
+
+
+def _check_delay_node(node):
+    if not isinstance(node, _delay_nodes):
+        return False
+    elif isinstance(node, ast.Name):
+        return node.id == 'x' or node.id in _delay_names
+    elif isinstance(node, ast.Call):
+        return isinstance(node.func, ast.Name)
+    elif isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float))
+    return True
+
+
+def _compile_delay(delay):
+    try:
+        tree = ast.parse(delay, mode='eval')
+    except SyntaxError:
+        tree = None
+    if tree is None or not all(_check_delay_node(node)
+                               for node in ast.walk(tree)):
+        msg = 'Invalid retry delay expression: '+delay
+        raise ConfigValidationError(msg)
+    code = compile(tree, '<delay>', 'eval')
+    namespace = dict(_delay_names, __builtins__={})
+    return lambda x: eval(code, namespace, {'x': x})
 
 
 def build_backoff_function(retry):
@@ -260,12 +545,21 @@ def build_backoff_function(retry):
         return no_retries
     maximum = int(retry.get('maximum', 0))
     delay = retry.get('delay', '300')
-    delay_func = eval('lambda x: '+delay, math.__dict__)
+    delay_func = _compile_delay(delay)
+    table_size = min(maximum, _delay_table_size)
+    try:
+        delays = [delay_func(attempts)
+                  for attempts in range(1, table_size+1)]
+    except (ArithmeticError, ValueError, TypeError) as exc:
+        msg = 'Invalid retry delay expression: {0} ({1})'.format(delay, exc)
+        raise ConfigValidationError(msg)
 
     def backoff(envelope, attempts):
         if attempts > maximum:
             return None
-        return delay_func(attempts)
+        elif attempts > table_size:
+            return delay_func(attempts)
+        return delays[attempts-1]
     return backoff
 
 
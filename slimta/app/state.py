@@ -195,6 +195,95 @@ class SlimtaState(object):
         self.ssl_contexts[key] = ctx
         return ctx
 
+    def _get_smtp_relay_kwargs(self, options):
+        from .helpers import fill_hostname_template
+        kwargs = {}
+        kwargs['connect_timeout'] = options.get('connect_timeout', 30)
+        kwargs['command_timeout'] = options.get('command_timeout', 30)
+        kwargs['data_timeout'] = options.get('data_timeout', 60)
+        kwargs['idle_timeout'] = options.get('idle_timeout', 10)
+        kwargs['pool_size'] = options.get('concurrent_connections', 5)
+        kwargs['ehlo_as'] = fill_hostname_template(options.ehlo_as)
+        kwargs['context'] = self._get_client_ssl_context(options.tls)
+        return kwargs
+
+    def _get_static_relay_kwargs(self, options, host, port):
+        from .helpers import get_relay_credentials
+        kwargs = self._get_smtp_relay_kwargs(options)
+        kwargs['host'] = host
+        kwargs['port'] = port
+        if 'credentials' in options:
+            credentials = get_relay_credentials(options.credentials)
+            kwargs['credentials'] = credentials
+        if options.ipv4_only:
+            socket_creator = build_ipv4_socket_creator([port])
+            kwargs['socket_creator'] = socket_creator  # type: ignore
+        return kwargs
+
+    def _start_mx_relay(self, options):
+        from slimta.relay.smtp.mx import MxSmtpRelay
+        kwargs = self._get_smtp_relay_kwargs(options)
+        if options.ipv4_only:
+            socket_creator = build_ipv4_socket_creator([25])
+            kwargs['socket_creator'] = socket_creator  # type: ignore
+        new_relay = MxSmtpRelay(**kwargs)
+        if 'force_mx' in options:
+            for domain, dest in options.force_mx:
+                new_relay.force_mx(domain, dest)
+        return new_relay
+
+    def _start_static_relay(self, options):
+        from slimta.relay.smtp.static import StaticSmtpRelay
+        kwargs = self._get_static_relay_kwargs(
+            options, options.host, options.get('port', 25))
+        return StaticSmtpRelay(**kwargs)
+
+    def _start_lmtp_relay(self, options):
+        from slimta.relay.smtp.static import StaticLmtpRelay
+        kwargs = self._get_static_relay_kwargs(
+            options, options.get('host', 'localhost'),
+            options.get('port', 24))
+        return StaticLmtpRelay(**kwargs)
+
+    def _start_http_relay(self, options):
+        from slimta.relay.http import HttpRelay
+        from .helpers import fill_hostname_template
+        kwargs = {}
+        kwargs['ehlo_as'] = fill_hostname_template(options.ehlo_as)
+        kwargs['timeout'] = options.get('timeout', 60)
+        kwargs['idle_timeout'] = options.get('idle_timeout', 10)
+        kwargs['context'] = self._get_client_ssl_context(options.tls)
+        return HttpRelay(options.url, **kwargs)
+
+    def _start_blackhole_relay(self, options):
+        from slimta.relay.blackhole import BlackholeRelay
+        return BlackholeRelay()
+
+    def _start_pipe_relay(self, options):
+        from slimta.relay.pipe import PipeRelay
+        return PipeRelay(options.args)
+
+    def _start_maildrop_relay(self, options):
+        from slimta.relay.pipe import MaildropRelay
+        return MaildropRelay(options.path)
+
+    def _start_dovecot_relay(self, options):
+        from slimta.relay.pipe import DovecotLdaRelay
+        return DovecotLdaRelay(options.path)
+
+    def _start_custom_relay(self, options):
+        return custom_factory(options)
+
+    _relay_types = {'mx': _start_mx_relay,
+                    'static': _start_static_relay,
+                    'lmtp': _start_lmtp_relay,
+                    'http': _start_http_relay,
+                    'blackhole': _start_blackhole_relay,
+                    'pipe': _start_pipe_relay,
+                    'maildrop': _start_maildrop_relay,
+                    'dovecot': _start_dovecot_relay,
+                    'custom': _start_custom_relay}
+
     def _start_relay(self, name, options=None):
         if self.args.no_relay:
             return None
@@ -203,192 +292,169 @@ class SlimtaState(object):
         if not options:
             assert self.cfg is not None and self.cfg.relay is not None
             options = getattr(self.cfg.relay, name)
-        new_relay = None
-        if options.type == 'mx':
-            from slimta.relay.smtp.mx import MxSmtpRelay
-            from .helpers import fill_hostname_template
-            kwargs = {}
-            kwargs['connect_timeout'] = options.get('connect_timeout', 30)
-            kwargs['command_timeout'] = options.get('command_timeout', 30)
-            kwargs['data_timeout'] = options.get('data_timeout', 60)
-            kwargs['idle_timeout'] = options.get('idle_timeout', 10)
-            kwargs['pool_size'] = options.get('concurrent_connections', 5)
-            kwargs['ehlo_as'] = fill_hostname_template(options.ehlo_as)
-            kwargs['context'] = self._get_client_ssl_context(options.tls)
-            if options.ipv4_only:
-                socket_creator = build_ipv4_socket_creator([25])
-                kwargs['socket_creator'] = socket_creator  # type: ignore
-            new_relay = MxSmtpRelay(**kwargs)
-            if 'force_mx' in options:
-                for domain, dest in options.force_mx:
-                    new_relay.force_mx(domain, dest)
-        elif options.type == 'static':
-            from slimta.relay.smtp.static import StaticSmtpRelay
-            from .helpers import fill_hostname_template, get_relay_credentials
-            kwargs = {}
-            kwargs['host'] = options.host
-            kwargs['port'] = options.get('port', 25)
-            kwargs['connect_timeout'] = options.get('connect_timeout', 30)
-            kwargs['command_timeout'] = options.get('command_timeout', 30)
-            kwargs['data_timeout'] = options.get('data_timeout', 60)
-            kwargs['idle_timeout'] = options.get('idle_timeout', 10)
-            kwargs['pool_size'] = options.get('concurrent_connections', 5)
-            kwargs['ehlo_as'] = fill_hostname_template(options.ehlo_as)
-            kwargs['context'] = self._get_client_ssl_context(options.tls)
-            if 'credentials' in options:
-                credentials = get_relay_credentials(options.credentials)
-                kwargs['credentials'] = credentials
-            if options.ipv4_only:
-                socket_creator = build_ipv4_socket_creator([kwargs['port']])
-                kwargs['socket_creator'] = socket_creator  # type: ignore
-            new_relay = StaticSmtpRelay(**kwargs)
-        elif options.type == 'lmtp':
-            from slimta.relay.smtp.static import StaticLmtpRelay
-            from .helpers import fill_hostname_template, get_relay_credentials
-            kwargs = {}
-            kwargs['host'] = options.get('host', 'localhost')
-            kwargs['port'] = options.get('port', 24)
-            kwargs['connect_timeout'] = options.get('connect_timeout', 30)
-            kwargs['command_timeout'] = options.get('command_timeout', 30)
-            kwargs['data_timeout'] = options.get('data_timeout', 60)
-            kwargs['idle_timeout'] = options.get('idle_timeout', 10)
-            kwargs['pool_size'] = options.get('concurrent_connections', 5)
-            kwargs['ehlo_as'] = fill_hostname_template(options.ehlo_as)
-            kwargs['context'] = self._get_client_ssl_context(options.tls)
-            if 'credentials' in options:
-                credentials = get_relay_credentials(options.credentials)
-                kwargs['credentials'] = credentials
-            if options.ipv4_only:
-                socket_creator = build_ipv4_socket_creator([kwargs['port']])
-                kwargs['socket_creator'] = socket_creator  # type: ignore
-            new_relay = StaticLmtpRelay(**kwargs)
-        elif options.type == 'http':
-            from slimta.relay.http import HttpRelay
-            from .helpers import fill_hostname_template
-            kwargs = {}
-            kwargs['ehlo_as'] = fill_hostname_template(options.ehlo_as)
-            kwargs['timeout'] = options.get('timeout', 60)
-            kwargs['idle_timeout'] = options.get('idle_timeout', 10)
-            kwargs['context'] = self._get_client_ssl_context(options.tls)
-            new_relay = HttpRelay(options.url, **kwargs)
-        elif options.type == 'blackhole':
-            from slimta.relay.blackhole import BlackholeRelay
-            new_relay = BlackholeRelay()
-        elif options.type == 'pipe':
-            from slimta.relay.pipe import PipeRelay
-            new_relay = PipeRelay(options.args)
-        elif options.type == 'maildrop':
-            from slimta.relay.pipe import MaildropRelay
-            path = options.path
-            new_relay = MaildropRelay(path)
-        elif options.type == 'dovecot':
-            from slimta.relay.pipe import DovecotLdaRelay
-            path = options.path
-            new_relay = DovecotLdaRelay(path)
-        elif options.type == 'custom':
-            new_relay = custom_factory(options)
-        else:
+        try:
+            start_relay = self._relay_types[options.type]
+        except KeyError:
             msg = 'relay type does not exist: '+options.type
             raise ConfigValidationError(msg)
+        new_relay = start_relay(self, options)
         self.relays[name] = new_relay
         return new_relay
 
+    def _start_storage_queue(self, store, relay, options, bounce_queue):
+        from slimta.queue import Queue
+        from .helpers import build_backoff_function
+        backoff = build_backoff_function(options.retry)
+        new_queue = Queue(store, relay, backoff=backoff,
+                          bounce_queue=bounce_queue)
+        new_queue.start()
+        return new_queue
+
+    def _start_memory_queue(self, options, relay, bounce_queue):
+        from slimta.queue.dict import DictStorage
+        store = DictStorage()
+        return self._start_storage_queue(store, relay, options, bounce_queue)
+
+    def _start_disk_queue(self, options, relay, bounce_queue):
+        from slimta.diskstorage import DiskStorage
+        env_dir = options.envelope_dir
+        meta_dir = options.meta_dir
+        tmp_dir = options.tmp_dir
+        store = DiskStorage(env_dir, meta_dir, tmp_dir)
+        return self._start_storage_queue(store, relay, options, bounce_queue)
+
+    def _start_redis_queue(self, options, relay, bounce_queue):
+        from slimta.redisstorage import RedisStorage
+        kwargs = {}
+        if 'host' in options:
+            kwargs['host'] = options.host
+        if 'port' in options:
+            kwargs['port'] = int(options.port)
+        if 'db' in options:
+            kwargs['db'] = int(options.db)
+        if 'password' in options:
+            kwargs['password'] = options.password
+        if 'socket_timeout' in options:
+            kwargs['socket_timeout'] = float(options.socket_timeout)
+        if 'prefix' in options:
+            kwargs['prefix'] = options.prefix
+        store = RedisStorage(**kwargs)
+        return self._start_storage_queue(store, relay, options, bounce_queue)
+
+    def _start_aws_queue(self, options, relay, bounce_queue):
+        from slimta.cloudstorage import CloudStorage
+        from slimta.cloudstorage.aws import SimpleStorageService, \
+            SimpleQueueService
+        import boto
+        if 'access_key_id' in options:
+            from boto.s3.connection import S3Connection
+            s3_conn = S3Connection(options.access_key_id,
+                                   options.secret_access_key)
+        else:
+            s3_conn = boto.connect_s3()
+        s3_bucket = s3_conn.get_bucket(options.bucket_name)
+        s3 = SimpleStorageService(s3_bucket, timeout=20.0)
+        sqs = None
+        if 'queue_name' in options:
+            from boto.sqs import connect_to_region
+            region = options.get('queue_region', 'us-west-2')
+            if 'access_key_id' in options:
+                sqs_conn = connect_to_region(
+                    region, aws_access_key_id=options.access_key_id,
+                    aws_secret_access_key=options.secret_access_key)
+            else:
+                sqs_conn = connect_to_region(region)
+            sqs_queue = sqs_conn.create_queue(options.queue_name)
+            sqs = SimpleQueueService(sqs_queue, timeout=10.0)
+        store = CloudStorage(s3, sqs)
+        return self._start_storage_queue(store, relay, options, bounce_queue)
+
+    def _start_proxy_queue(self, options, relay, bounce_queue):
+        from slimta.queue.proxy import ProxyQueue
+        return ProxyQueue(relay)
+
+    def _start_custom_queue(self, options, relay, bounce_queue):
+        return custom_factory(options, relay)
+
+    _queue_types = {'memory': _start_memory_queue,
+                    'disk': _start_disk_queue,
+                    'redis': _start_redis_queue,
+                    'aws': _start_aws_queue,
+                    'proxy': _start_proxy_queue,
+                    'custom': _start_custom_queue}
+
     def _start_queue(self, name, options=None):
         if name in self.queues:
             return self.queues[name]
         if not options:
             assert self.cfg is not None and self.cfg.queue is not None
             options = getattr(self.cfg.queue, name)
-        from .helpers import add_queue_policies, build_backoff_function
-        new_queue = None
+        from .helpers import add_queue_policies
         relay_name = options.relay
         relay = self._start_relay(relay_name) if relay_name else None
         bounce_queue_name = options.get('bounce_queue', name)
         bounce_queue = self._start_queue(bounce_queue_name) \
             if bounce_queue_name != name else None
-        if options.type == 'memory':
-            from slimta.queue import Queue
-            from slimta.queue.dict import DictStorage
-            store = DictStorage()
-            backoff = build_backoff_function(options.retry)
-            new_queue = Queue(store, relay, backoff=backoff,
-                              bounce_queue=bounce_queue)
-            new_queue.start()
-        elif options.type == 'disk':
-            from slimta.queue import Queue
-            from slimta.diskstorage import DiskStorage
-            env_dir = options.envelope_dir
-            meta_dir = options.meta_dir
-            tmp_dir = options.tmp_dir
-            store = DiskStorage(env_dir, meta_dir, tmp_dir)
-            backoff = build_backoff_function(options.retry)
-            new_queue = Queue(store, relay, backoff=backoff,
-                              bounce_queue=bounce_queue)
-            new_queue.start()
-        elif options.type == 'redis':
-            from slimta.queue import Queue
-            from slimta.redisstorage import RedisStorage
-            kwargs = {}
-            if 'host' in options:
-                kwargs['host'] = options.host
-            if 'port' in options:
-                kwargs['port'] = int(options.port)
-            if 'db' in options:
-                kwargs['db'] = int(options.db)
-            if 'password' in options:
-                kwargs['password'] = options.password
-            if 'socket_timeout' in options:
-                kwargs['socket_timeout'] = float(options.socket_timeout)
-            if 'prefix' in options:
-                kwargs['prefix'] = options.prefix
-            store = RedisStorage(**kwargs)
-            backoff = build_backoff_function(options.retry)
-            new_queue = Queue(store, relay, backoff=backoff,
-                              bounce_queue=bounce_queue)
-            new_queue.start()
-        elif options.type == 'aws':
-            from slimta.queue import Queue
-            from slimta.cloudstorage import CloudStorage
-            from slimta.cloudstorage.aws import SimpleStorageService, \
-                SimpleQueueService
-            import boto
-            if 'access_key_id' in options:
-                from boto.s3.connection import S3Connection
-                s3_conn = S3Connection(options.access_key_id,
-                                       options.secret_access_key)
-            else:
-                s3_conn = boto.connect_s3()
-            s3_bucket = s3_conn.get_bucket(options.bucket_name)
-            s3 = SimpleStorageService(s3_bucket, timeout=20.0)
-            sqs = None
-            if 'queue_name' in options:
-                from boto.sqs import connect_to_region
-                region = options.get('queue_region', 'us-west-2')
-                if 'access_key_id' in options:
-                    sqs_conn = connect_to_region(
-                        region, aws_access_key_id=options.access_key_id,
-                        aws_secret_access_key=options.secret_access_key)
-                else:
-                    sqs_conn = connect_to_region(region)
-                sqs_queue = sqs_conn.create_queue(options.queue_name)
-                sqs = SimpleQueueService(sqs_queue, timeout=10.0)
-            store = CloudStorage(s3, sqs)
-            backoff = build_backoff_function(options.retry)
-            new_queue = Queue(store, relay, backoff=backoff,
-                              bounce_queue=bounce_queue)
-            new_queue.start()
-        elif options.type == 'proxy':
-            from slimta.queue.proxy import ProxyQueue
-            new_queue = ProxyQueue(relay)
-        elif options.type == 'custom':
-            new_queue = custom_factory(options, relay)
-        else:
+        try:
+            start_queue = self._queue_types[options.type]
+        except KeyError:
             msg = 'queue type does not exist: '+options.type
             raise ConfigValidationError(msg)
+        new_queue = start_queue(self, options, relay, bounce_queue)
         add_queue_policies(new_queue, options.get('policies', []))
         self.queues[name] = new_queue
         return new_queue
 
+    def _set_max_accept(self, edge, options):
+        if 'max_accept' in options and edge.server is not None:
+            edge.server.max_accept = int(options.max_accept)
+
+    def _start_smtp_edge(self, options, queue):
+        from slimta.edge.smtp import SmtpEdge
+        from .helpers import build_smtpedge_validators
+        from .helpers import fill_hostname_template
+        kwargs = {}
+        kwargs['context'] = self._get_server_ssl_context(options.tls)
+        kwargs['tls_immediately'] = options.tls_immediately
+        kwargs['validator_class'] = build_smtpedge_validators(options)
+        kwargs['auth'] = [b'PLAIN', b'LOGIN']
+        kwargs['command_timeout'] = 20.0
+        kwargs['data_timeout'] = 30.0
+        kwargs['max_size'] = int(options.get('max_size', 10485760))
+        kwargs['hostname'] = fill_hostname_template(options.hostname)
+        for listener in Listeners(options, 25):
+            new_edge = SmtpEdge(listener, queue, **kwargs)
+            if options.proxyprotocol:
+                ProxyProtocol.mixin(new_edge)
+            self._set_max_accept(new_edge, options)
+            new_edge.start()
+            self.edges.append(new_edge)
+
+    def _start_http_edge(self, options, queue):
+        from slimta.edge.wsgi import WsgiEdge
+        from .helpers import build_wsgiedge_validators
+        from .helpers import fill_hostname_template
+        kwargs = {}
+        kwargs['hostname'] = fill_hostname_template(options.hostname)
+        kwargs['validator_class'] = build_wsgiedge_validators(options)
+        kwargs['uri_pattern'] = options.uri
+        kwargs['context'] = self._get_server_ssl_context(options.tls)
+        for listener in Listeners(options, 8025):
+            new_edge = WsgiEdge(queue, listener=listener, **kwargs)
+            if options.proxyprotocol:
+                ProxyProtocol.mixin(new_edge)
+            self._set_max_accept(new_edge, options)
+            new_edge.start()
+            self.edges.append(new_edge)
+
+    def _start_custom_edge(self, options, queue):
+        new_edge = custom_factory(options, queue)
+        self.edges.append(new_edge)
+
+    _edge_types = {'smtp': _start_smtp_edge,
+                   'http': _start_http_edge,
+                   'custom': _start_custom_edge}
+
     def _start_edge(self, name, options=None):
         if self.args.no_edge:
             return None
@@ -397,49 +463,17 @@ class SlimtaState(object):
             options = getattr(self.cfg.edge, name)
         queue_name = options.queue
         queue = self._start_queue(queue_name)
-        if options.type == 'smtp':
-            from slimta.edge.smtp import SmtpEdge
-            from .helpers import build_smtpedge_validators
-            from .helpers import fill_hostname_template
-            kwargs = {}
-            kwargs['context'] = self._get_server_ssl_context(options.tls)
-            kwargs['tls_immediately'] = options.tls_immediately
-            kwargs['validator_class'] = build_smtpedge_validators(options)
-            kwargs['auth'] = [b'PLAIN', b'LOGIN']
-            kwargs['command_timeout'] = 20.0
-            kwargs['data_timeout'] = 30.0
-            kwargs['max_size'] = int(options.get('max_size', 10485760))
-            kwargs['hostname'] = fill_hostname_template(options.hostname)
-            for listener in Listeners(options, 25):
-                new_edge = SmtpEdge(listener, queue, **kwargs)
-                if options.proxyprotocol:
-                    ProxyProtocol.mixin(new_edge)
-                new_edge.start()
-                self.edges.append(new_edge)
-        elif options.type == 'http':
-            from slimta.edge.wsgi import WsgiEdge
-            from .helpers import build_wsgiedge_validators
-            from .helpers import fill_hostname_template
-            kwargs = {}
-            kwargs['hostname'] = fill_hostname_template(options.hostname)
-            kwargs['validator_class'] = build_wsgiedge_validators(options)
-            kwargs['uri_pattern'] = options.uri
-            kwargs['context'] = self._get_server_ssl_context(options.tls)
-            for listener in Listeners(options, 8025):
-                new_edge = WsgiEdge(queue, listener=listener, **kwargs)
-                if options.proxyprotocol:
-                    ProxyProtocol.mixin(new_edge)
-                new_edge.start()
-                self.edges.append(new_edge)
-        elif options.type == 'custom':
-            new_edge = custom_factory(options, queue)
-            self.edges.append(new_edge)
-        else:
+        try:
+            start_edge = self._edge_types[options.type]
+        except KeyError:
             msg = 'edge type does not exist: '+options.type
             raise ConfigValidationError(msg)
+        start_edge(self, options, queue)
 
     def reload_config(self):
+        from .helpers import clear_caches
         self.load_config()
+        clear_caches()
         old_edges = self.edges[:]
         old_queues = self.queues.copy()
         old_relays = self.relays.copy()
@@ -458,25 +492,27 @@ class SlimtaState(object):
         if action == 'reload':
             self.reload_config()
 
-    def start_everything(self):
-        self.cached_listeners = self.listeners.copy()
-        self.listeners = {}
-        assert self.cfg is not None and self.cfg.queue is not None
+    def _bootstrap(self):
+        cfg = self.cfg
+        assert cfg is not None and cfg.queue is not None
 
-        if 'relay' in self.cfg:
-            assert self.cfg.relay is not None
-            for name, options in list(dict(self.cfg.relay).items()):
+        if 'relay' in cfg and not self.args.no_relay:
+            assert cfg.relay is not None
+            for name, options in cfg.relay.items():
                 self._start_relay(name, options)
 
-        assert self.cfg is not None and self.cfg.queue is not None
-        for name, options in list(dict(self.cfg.queue).items()):
+        for name, options in cfg.queue.items():
             self._start_queue(name, options)
 
-        if 'edge' in self.cfg:
-            assert self.cfg.edge is not None
-            for name, options in list(dict(self.cfg.edge).items()):
+        if 'edge' in cfg and not self.args.no_edge:
+            assert cfg.edge is not None
+            for name, options in cfg.edge.items():
                 self._start_edge(name, options)
 
+    def start_everything(self):
+        self.cached_listeners = self.listeners.copy()
+        self.listeners = {}
+        self._bootstrap()
         self.cached_listeners = {}
 
     def loop(self):
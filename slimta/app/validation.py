@@ -56,7 +56,10 @@ class ConfigValidation(object):
                 else:
                     continue
             if not isinstance(v, keydict[k][0]):
-                type_name = keydict[k][0].__name__.lower()
+                types = keydict[k][0]
+                if not isinstance(types, tuple):
+                    types = (types, )
+                type_name = ' or '.join(t.__name__.lower() for t in types)
                 msg = "Expected key '{0}' to be {1}".format(k, type_name)
                 raise ConfigValidationError(msg, stack)
             del keydict[k]
@@ -81,6 +84,16 @@ class ConfigValidation(object):
         keydict = {'type': (str, True)}
         self._check_keys(opts, keydict, stack)
 
+    def _check_spamassassin(self, opts, stack):
+        keydict = {'host': (str, False),
+                   'port': ((int, str), False),
+                   'path': (str, False),
+                   'max_bytes': (int, False)}
+        self._check_keys(opts, keydict, stack)
+        if 'path' in opts and ('host' in opts or 'port' in opts):
+            msg = "Cannot use both 'path' and 'host' or 'port' keys"
+            raise ConfigValidationError(msg, stack)
+
     def _check_listener(self, opts, stack):
         keydict = {'type': (str, False),
                    'interface': (str, False),
@@ -100,6 +113,7 @@ class ConfigValidation(object):
                    'listeners': (Sequence, False),
                    'hostname': (str, False),
                    'max_size': (int, False),
+                   'max_accept': (int, False),
                    'tls': (Mapping, False),
                    'tls_immediately': (bool, False),
                    'proxyprotocol': (bool, False),
@@ -108,6 +122,9 @@ class ConfigValidation(object):
         if not self._check_ref('queue', opts.queue):
             msg = "No match for reference key 'queue'"
             raise ConfigValidationError(msg, stack)
+        if opts.get('max_accept', 1) < 1:
+            msg = "Expected key 'max_accept' to be at least 1"
+            raise ConfigValidationError(msg, stack)
         if opts.type == 'custom' and not opts.get('factory'):
             msg = "The 'factory' key must be given when using 'custom' type"
             raise ConfigValidationError(msg, stack)
@@ -144,6 +161,9 @@ class ConfigValidation(object):
                                      'ignore': (Sequence, False)}
                     self._check_keys(opts.rules.dnsbl, dnsbl_keydict,
                                      stack+['dnsbl'])
+            if 'reject_spam' in opts.rules:
+                self._check_spamassassin(opts.rules.reject_spam,
+                                         stack+['reject_spam'])
             if 'lookup_sender' in opts.rules:
                 self._check_lookup(opts.rules.lookup_sender,
                                    stack+['lookup_sender'])
@@ -179,6 +199,8 @@ class ConfigValidation(object):
                 msg = 'Expected dictionary'
                 raise ConfigValidationError(msg, mystack)
             self._check_keys(p, {'type': (str, True)}, mystack)
+            if p.get('type') == 'spamassassin':
+                self._check_spamassassin(p, mystack)
         if 'retry' in opts:
             retry_keydict = {'maximum': (int, False),
                              'delay': (str, False)}